@@ -0,0 +1,853 @@
+# -----------------------------------------------------------------------------
+#  Shared Census ACS -> S3 -> Redshift ETL
+# -----------------------------------------------------------------------------
+# Used by both entry-point scripts:
+#   - Test_census_tract.py: tract-level pipeline (run(2023, 'tract', datasets))
+#   - test_final_zcta.py: ZCTA-level pipeline (run(2017, 'zip code tabulation area', datasets))
+#
+# The following libraries are imported to provide essential functionality for the pipeline:
+#   - os, re, json: For file and data handling.
+#   - sqlite3: For lightweight local database operations (tracking API usage).
+#   - asyncio, httpx: For issuing Census API requests concurrently over a shared HTTP/2 client.
+#   - logging: For logging progress and errors throughout the script.
+#   - time: For managing delays and timestamps.
+#   - queue, atexit: For batching usage-log writes on a background thread and flushing them on exit.
+#   - threading, concurrent.futures: For the usage-log writer thread and parallel S3 uploads.
+#   - pandas: For data manipulation and analysis.
+#   - datetime: For working with dates and times, especially for logging and data records.
+#   - dotenv: For loading environment variables from a .env file (API keys, credentials).
+#   - sqlalchemy: For connecting to and executing SQL on Redshift databases.
+#   - tenacity: For implementing retry logic with exponential backoff on API calls.
+#   - boto3: For interacting with AWS S3 (uploading and managing files).
+#   - functools, diskcache: For caching Census variable metadata in memory and on disk.
+#   - orjson, pyarrow: For parsing API response bytes directly and serializing typed columns to Parquet.
+import os
+import re
+import asyncio
+import json
+import atexit
+import functools
+import queue
+import sqlite3
+import httpx
+import logging
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from datetime import datetime, date, timezone
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import URL
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type, RetryError
+import boto3
+import diskcache
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# -----------------------------------------------------------------------------
+#  Configuration & Logging
+# -----------------------------------------------------------------------------
+load_dotenv()
+# CENSUS_API_KEY is preferred; API_KEY is what the ZCTA script historically read
+API_KEY = os.getenv("CENSUS_API_KEY") or os.getenv("API_KEY")
+DB_PATH = "census_api_usage.db"
+# Maximum concurrent HTTP connections to the Census API
+MAX_CONNECTIONS = 16
+# Number of Parquet files per table load; Redshift COPY reads one file per slice in parallel
+N_SLICES = 16
+# Fallback pace when the API does not advertise X-RateLimit-* headers
+RATE_LIMIT_PER_SEC = 10.0
+META_CACHE_DIR = os.path.expanduser("~/.cache/census_meta")
+META_CACHE_TTL = 86400 * 30
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+# httpx logs every request URL at INFO, which would include the API key
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# -----------------------------------------------------------------------------
+#  0. Load Excel-based Column Mapping
+# -----------------------------------------------------------------------------
+MAPPING_FILE = "Census Data Fields for API.xlsx"
+
+
+@functools.lru_cache(maxsize=None)
+def get_column_mapping() -> dict:
+    """
+    Loads the API-code -> Tableau field mapping from the Excel file on first use and caches it.
+    Only the two mapping columns are read, using the Rust-based calamine engine.
+    """
+    try:
+        mapping_df = pd.read_excel(
+            MAPPING_FILE,
+            engine='calamine',
+            usecols=['API pull code', 'Relevant Field in Tableau Extract']
+        )
+        mapping_df['API pull code'] = mapping_df['API pull code'].str.upper().str.strip()
+        column_mapping = dict(
+            zip(
+                mapping_df['API pull code'],
+                mapping_df['Relevant Field in Tableau Extract']
+            )
+        )
+        logging.info(f"Loaded {len(column_mapping)} column mappings from Excel")
+        return column_mapping
+    except Exception as e:
+        logging.error(f"Failed to load Excel mapping file: {e}")
+        raise
+
+# Geography/identifier columns that are expected to have no entry in the mapping file
+UNMAPPED_IGNORE = frozenset({'TRACT', 'COUNTY', 'STATE', 'STATE_FIPS', 'NAME', 'ZIP CODE TABULATION AREA'})
+
+
+@functools.lru_cache(maxsize=None)
+def get_known_columns() -> frozenset:
+    """
+    Column names that should not be reported as unmapped: every API code in the mapping file
+    plus the geography/identifier columns. Built once per process.
+    """
+    return frozenset(get_column_mapping()) | UNMAPPED_IGNORE
+
+
+# Supported geography levels (the Census API 'for' clause):
+#   - by_state: whether the level nests in states, enabling the per-state fallback
+#   - sortkey: Redshift SORTKEY columns for the loaded table
+GEO_LEVELS = {
+    'tract': {
+        'by_state': True,
+        'sortkey': ['state_fips', 'county', 'tract'],
+    },
+    'zip code tabulation area': {
+        'by_state': False,
+        'sortkey': ['zip code tabulation area'],
+    },
+}
+
+# -----------------------------------------------------------------------------
+#  1. Database Utility: Initialize usage table
+# -----------------------------------------------------------------------------
+OPTIMIZE_INTERVAL_SEC = 15 * 60
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_DELAY_SEC = 0.5
+
+_usage_conn = None
+_usage_lock = threading.Lock()
+_usage_writer = None
+_LOG_Q = queue.Queue()
+
+
+def init_db(db_path: str = DB_PATH):
+    """
+    Initializes the local SQLite database for tracking API usage.
+    Creates a 'usage' table if it does not already exist. This table stores
+    the timestamp, endpoint, parameters, and headers for each API call made.
+    Opens a single long-lived connection in WAL mode with synchronous=NORMAL and
+    starts the background thread that writes queued usage rows in batches.
+    """
+    global _usage_conn, _usage_writer
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS usage (
+            id        INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT    NOT NULL,
+            endpoint  TEXT    NOT NULL,
+            params    TEXT,
+            headers   TEXT    NOT NULL
+        )
+        """
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    with _usage_lock:
+        if _usage_conn is not None:
+            _usage_conn.close()
+        _usage_conn = conn
+        if _usage_writer is None:
+            _usage_writer = threading.Thread(target=_usage_writer_loop, name="usage-writer", daemon=True)
+            _usage_writer.start()
+            atexit.register(_LOG_Q.join)
+
+
+def _usage_writer_loop():
+    """
+    Drains the usage queue forever, inserting up to LOG_BATCH_SIZE rows per transaction.
+    Waits LOG_FLUSH_DELAY_SEC after the first row so bursts of API calls share one commit.
+    Runs PRAGMA optimize at most once every 15 minutes.
+    """
+    last_optimize = time.monotonic()
+    while True:
+        batch = [_LOG_Q.get()]
+        time.sleep(LOG_FLUSH_DELAY_SEC)
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(_LOG_Q.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with _usage_lock:
+                _usage_conn.execute("BEGIN")
+                _usage_conn.executemany(
+                    "INSERT INTO usage (timestamp, endpoint, params, headers) VALUES (?, ?, ?, ?)",
+                    batch
+                )
+                _usage_conn.execute("COMMIT")
+                now = time.monotonic()
+                if now - last_optimize >= OPTIMIZE_INTERVAL_SEC:
+                    _usage_conn.execute("PRAGMA optimize")
+                    last_optimize = now
+        except Exception as e:
+            with _usage_lock:
+                if _usage_conn is not None and _usage_conn.in_transaction:
+                    _usage_conn.execute("ROLLBACK")
+            logging.error(f"Failed to write {len(batch)} usage rows: {e}")
+        finally:
+            for _ in batch:
+                _LOG_Q.task_done()
+
+# -----------------------------------------------------------------------------
+#  2. Log API usage to SQLite
+# -----------------------------------------------------------------------------
+def log_usage(endpoint: str, params: dict, headers: httpx.Headers):
+    """
+    Logs each API call to the local SQLite database.
+    Stores the endpoint, parameters, and relevant rate limit headers for auditing and debugging.
+    The row is queued for the background writer, so no database work happens on the request path.
+    """
+    rl_headers = {k: v for k, v in headers.items() if k.lower().startswith("x-ratelimit")}
+    record = (
+        datetime.now(timezone.utc).isoformat(),
+        endpoint,
+        json.dumps(params, ensure_ascii=False),
+        json.dumps(rl_headers, ensure_ascii=False),
+    )
+    _LOG_Q.put(record)
+
+# -----------------------------------------------------------------------------
+#  3. Shared HTTP client, rate limiter & wrapped GET that logs usage
+# -----------------------------------------------------------------------------
+class RateLimiter:
+    """
+    Token bucket shared by all concurrent requests on the event loop.
+    Tokens refill at `rate` per second up to `capacity`; acquire() waits until one is available.
+    The bucket is additionally bounded by the server's X-RateLimit-* headers.
+    All state changes happen between awaits on a single event loop, so no lock is needed.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def update_from_headers(self, headers) -> None:
+        """
+        Keeps the bucket within the server's advertised quota: the burst is capped at
+        X-RateLimit-Remaining, and when the quota is exhausted the bucket is drained until
+        X-RateLimit-Reset (an epoch timestamp or a number of seconds). Requests are otherwise
+        paced at `rate`; the quota is not spread over the reset window, which for a daily
+        quota would throttle a run to one request every few minutes.
+        Responses without both headers leave the limiter unchanged.
+        """
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = int(remaining)
+            reset = float(reset)
+        except ValueError:
+            return
+        if remaining <= 0:
+            window = max(reset - time.time() if reset > 1e9 else reset, 1.0)
+            self.tokens = 0.0
+            # Refill only starts once the window resets
+            self.updated = time.monotonic() + window
+        else:
+            self.tokens = min(self.tokens, float(remaining))
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_PER_SEC, MAX_CONNECTIONS)
+# Set by run() for the duration of a pipeline run; see new_census_client()
+_client = None
+
+
+def new_census_client() -> httpx.AsyncClient:
+    """
+    Builds the HTTP/2 client used for every Census call: requests are multiplexed over
+    keep-alive connections and responses come back gzip-compressed.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=60,
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS),
+        headers={'Accept-Encoding': 'gzip, deflate'}
+    )
+
+
+async def census_get(url: str, params: dict) -> httpx.Response:
+    """
+    Makes a GET request to the Census API, automatically appending the API key.
+    Waits on the shared rate limiter (which is updated from the response's rate limit headers)
+    and reuses the run's shared HTTP/2 client.
+    Logs the API usage and raises an error if the request fails.
+    Returns the response object for further processing.
+    """
+    if _client is None:
+        raise RuntimeError("census_get() must be called from within run()")
+    p = params.copy()
+    p["key"] = API_KEY
+    await rate_limiter.acquire()
+    resp = await _client.get(url, params=p)
+    log_usage(url, p, resp.headers)
+    rate_limiter.update_from_headers(resp.headers)
+    resp.raise_for_status()
+    return resp
+
+# -----------------------------------------------------------------------------
+#  4. Fetch available variables via metadata
+# -----------------------------------------------------------------------------
+# In-process memo of get_available_variables: (year, dataset) -> Task resolving to a frozenset.
+# Tasks (rather than results) are stored so concurrent datasets sharing an endpoint share one
+# metadata fetch; functools.lru_cache cannot be used on coroutines.
+_available_variables = {}
+
+
+async def _load_available_variables(year: int, dataset: str) -> frozenset:
+    """
+    Reads the variable set for a dataset from the disk cache, or downloads variables.json
+    and stores it there for META_CACHE_TTL seconds.
+    """
+    key = f"{year}/{dataset}"
+    with diskcache.Cache(META_CACHE_DIR) as cache:
+        available = cache.get(key)
+        if available is None:
+            meta_url = f'https://api.census.gov/data/{year}/{dataset}/variables.json'
+            resp = await census_get(meta_url, {})
+            available = frozenset(orjson.loads(resp.content).get('variables', {}).keys())
+            cache.set(key, available, expire=META_CACHE_TTL)
+        else:
+            logging.info(f"Using cached variable metadata for {key}")
+    return available
+
+
+async def get_available_variables(year: int, dataset: str) -> frozenset:
+    """
+    Returns the set of variable names published for a Census dataset and year.
+    The metadata never changes for a released ACS year, so results are memoized in-process
+    and persisted to a disk cache (META_CACHE_DIR) across runs. Failed lookups are not cached.
+    """
+    key = (year, dataset)
+    task = _available_variables.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load_available_variables(year, dataset))
+        _available_variables[key] = task
+    try:
+        return await task
+    except Exception:
+        _available_variables.pop(key, None)
+        raise
+
+
+async def filter_available_variables(year: int, dataset: str, variables: list) -> list:
+    """
+    Checks which variables from the provided list are available in the specified Census dataset and year.
+    Returns a filtered list of valid variable names.
+    """
+    available = await get_available_variables(year, dataset)
+    return [v for v in variables if v in available]
+
+# -----------------------------------------------------------------------------
+#  5. Fetch Census data with retry/backoff
+# -----------------------------------------------------------------------------
+# Estimate / margin-of-error / percent variables, e.g. DP02_0060E, DP03_0097PE, S0101_C01_001M
+NUMERIC_VAR_RE = re.compile(r'^[A-Z]\w*_\d+[A-Z]*(E|M|PE|PM)$')
+
+
+def census_array(name: str, values: tuple) -> pa.Array:
+    """
+    Builds one typed Arrow column from the raw API values for a variable.
+    Numeric variables are parsed as int64, or float64 if any value has a fractional part
+    (e.g. median age); values that do not parse are coerced to null. All other columns are strings.
+    """
+    arr = pa.array(values)
+    if pa.types.is_null(arr.type):
+        # An all-null numeric variable stays numeric so its type matches other states/runs
+        return pa.nulls(len(values), pa.int64()) if NUMERIC_VAR_RE.match(name) else arr
+    if not NUMERIC_VAR_RE.match(name):
+        return arr if pa.types.is_string(arr.type) else arr.cast(pa.string())
+    if not pa.types.is_string(arr.type):
+        return arr
+    for numeric_type in (pa.int64(), pa.float64()):
+        try:
+            return arr.cast(numeric_type)
+        except pa.ArrowInvalid:
+            continue
+    # Non-numeric annotations become nulls so the column keeps a numeric Redshift type
+    return pa.array(pd.to_numeric(pd.Series(values, dtype=object), errors='coerce'), from_pandas=True)
+
+
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_random_exponential(multiplier=1, max=60),
+    retry=retry_if_exception_type((httpx.HTTPStatusError, httpx.TransportError))
+)
+async def get_census_data(
+    year: int,
+    dataset: str,
+    variables: list,
+    state: str,
+    all_vars: list,
+    geo_level: str = 'tract'
+) -> pd.DataFrame:
+    """
+    Fetches Census data at the given geography level for the specified year, dataset, variables,
+    and state(s). Passing state='*' pulls every state in a single nationwide request; state=None
+    omits the 'in' clause for levels that do not nest in states (e.g. ZCTAs).
+    Retries on HTTP and transport errors with exponential backoff. Returns a DataFrame with all
+    requested columns, filling missing columns with None if necessary.
+    """
+    vars_for_request = ['NAME'] + variables
+    vars_for_request = list(dict.fromkeys(vars_for_request))
+
+    params = {
+        'get': ','.join(vars_for_request),
+        'for': f'{geo_level}:*'
+    }
+    if state is not None:
+        params['in'] = f'state:{state}'
+    response = await census_get(f'https://api.census.gov/data/{year}/{dataset}', params)
+
+    data = orjson.loads(response.content)
+    header, body = data[0], data[1:]
+    columns = list(zip(*body)) if body else [()] * len(header)
+    table = pa.Table.from_arrays(
+        [census_array(name, values) for name, values in zip(header, columns)],
+        names=header
+    )
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    if 'state' in df.columns:
+        df['state_fips'] = df['state']
+
+    all_vars_set = frozenset(all_vars)
+    for missing in all_vars_set.difference(df.columns):
+        # Keep numeric variables numeric even when absent, so the Redshift schema stays stable
+        if NUMERIC_VAR_RE.match(missing):
+            df[missing] = pd.Series(pd.NA, index=df.index, dtype=pd.ArrowDtype(pa.int64()))
+        else:
+            df[missing] = None
+
+    # Requested variables first (in requested order), then geography columns
+    wanted = list(dict.fromkeys(all_vars))
+    extras = [c for c in df.columns if c not in all_vars_set]
+    df = df.reindex(columns=wanted + extras)
+    return df
+
+# -----------------------------------------------------------------------------
+#  6. Redshift & S3 config
+# -----------------------------------------------------------------------------
+REDSHIFT_CONFIG = {
+    'host': os.getenv('REDSHIFT_HOST'),
+    'port': os.getenv('REDSHIFT_PORT'),
+    'database': os.getenv('REDSHIFT_DATABASE'),
+    'user': os.getenv('REDSHIFT_USER'),
+    'password': os.getenv('REDSHIFT_PASSWORD'),
+    'schema': os.getenv('REDSHIFT_SCHEMA', 'census_tract_2023'),  # set per pipeline in .env
+    'timeout': 30
+}
+
+connection_url = URL.create(
+    drivername='redshift+redshift_connector',
+    username=REDSHIFT_CONFIG['user'],
+    password=REDSHIFT_CONFIG['password'],
+    host=REDSHIFT_CONFIG['host'],
+    port=REDSHIFT_CONFIG['port'],
+    database=REDSHIFT_CONFIG['database']
+)
+
+engine = create_engine(
+    connection_url,
+    connect_args={'timeout': REDSHIFT_CONFIG['timeout'], 'sslmode': 'prefer'},
+    execution_options={'autocommit': True, 'isolation_level': 'AUTOCOMMIT'}
+)
+
+S3_BUCKET = 'nigen'
+S3_PREFIX = 'Demographics'
+REDSHIFT_IAM_ROLE_ARN = os.getenv('REDSHIFT_IAM_ROLE_ARN')
+AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
+AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID', '')
+AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY', '')
+
+# Created once: building a boto3 client loads the service model and costs ~100ms per call
+S3 = boto3.client(
+    's3',
+    region_name=AWS_REGION,
+    aws_access_key_id=AWS_ACCESS_KEY_ID,
+    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
+)
+
+# -----------------------------------------------------------------------------
+#  7. Redshift table & S3 utilities
+# -----------------------------------------------------------------------------
+# This section contains utility functions for interacting with AWS Redshift and S3.
+# Functions here help automate table creation, data upload, and other Redshift/S3 tasks.
+# You can add more functions below for:
+#   - Loading data from S3 to Redshift
+#   - Deleting S3 objects
+#   - Querying Redshift tables
+#   - Managing Redshift schemas
+#   - Any other Redshift/S3 related utilities
+
+def redshift_type(col: str, pa_type: pa.DataType) -> str:
+    """
+    Maps a Parquet/Arrow column to the Redshift column type used in the table DDL,
+    so that COPY ... FORMAT AS PARQUET loads each column without conversion.
+    Integer estimates/MOEs get AZ64 encoding; NAME holds long "Census Tract ..., County, State" labels.
+    """
+    if col.upper() == 'NAME':
+        return 'VARCHAR(512)'
+    if pa.types.is_integer(pa_type):
+        return 'BIGINT ENCODE AZ64'
+    if pa.types.is_floating(pa_type):
+        return 'DOUBLE PRECISION'
+    if pa.types.is_boolean(pa_type):
+        return 'BOOLEAN'
+    return 'VARCHAR(255)'
+
+
+def to_arrow_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Converts a DataFrame to an Arrow table for Parquet output.
+    Numeric variables that are missing or entirely null are already int64 nulls; only
+    non-numeric columns that are entirely empty have no inferable type, so those are
+    written as strings.
+    """
+    # Drop the pandas dtype metadata: after chunks are concatenated with type promotion it
+    # would still describe the first chunk's types and break reading the Parquet back
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+    return table
+
+
+def existing_table_columns(conn, table_name: str) -> list:
+    """
+    Returns [(column_name, data_type, max_length), ...] for an existing Redshift table,
+    in column order, or an empty list if the table does not exist.
+    """
+    rows = conn.execute(
+        text(
+            """
+            SELECT column_name, data_type, character_maximum_length
+            FROM svv_columns
+            WHERE table_schema = :schema AND table_name = :table
+            ORDER BY ordinal_position
+            """
+        ),
+        {'schema': REDSHIFT_CONFIG['schema'], 'table': table_name}
+    )
+    return [(name, data_type, max_length) for name, data_type, max_length in rows]
+
+
+def expected_table_columns(arrow_schema: pa.Schema) -> list:
+    """
+    Returns the [(column_name, data_type, max_length), ...] that svv_columns would report for
+    a table created from this Arrow schema (Redshift folds names to lower case).
+    """
+    svv_names = {'VARCHAR': 'character varying'}
+    columns = []
+    for field in arrow_schema:
+        ddl_type = redshift_type(field.name, field.type).split(' ENCODE')[0]
+        base_type, _, length = ddl_type.partition('(')
+        columns.append((
+            field.name.lower(),
+            svv_names.get(base_type, base_type.lower()),
+            int(length.rstrip(')')) if length else None
+        ))
+    return columns
+
+
+def create_redshift_table(conn, table_name: str, arrow_schema: pa.Schema, sortkey: list) -> None:
+    """
+    Creates a new table in the specified Redshift schema matching the given Arrow schema,
+    dropping any existing table first. Column types follow the Parquet file types
+    (see redshift_type). Runs on the caller's connection so it can share a transaction.
+    """
+    schema = REDSHIFT_CONFIG['schema']
+    column_defs = [f'"{field.name}" {redshift_type(field.name, field.type)}' for field in arrow_schema]
+    sort_cols = ', '.join(f'"{col}"' for col in sortkey)
+    ddl = f"""
+    CREATE TABLE "{schema}"."{table_name}" (
+        {', '.join(column_defs)}
+    )
+    DISTSTYLE EVEN
+    SORTKEY ({sort_cols});
+    """
+    conn.execute(text(f'DROP TABLE IF EXISTS "{schema}"."{table_name}";'))
+    conn.execute(text(ddl))
+    logging.info(f"Created table {schema}.{table_name}")
+
+
+def upload_parquet_to_s3(table_name: str, table: pa.Table) -> str:
+    """
+    Splits an Arrow table into up to N_SLICES equal row ranges (zero-copy slices), serializes
+    each to snappy-compressed Parquet in memory and uploads them to S3 concurrently under a
+    timestamped prefix. Nothing is written to local disk.
+    Writes a COPY manifest listing every file and returns the manifest's S3 URI, so Redshift
+    can load the files in parallel across slices.
+    """
+    timestamp = int(time.time())
+    prefix = f"{S3_PREFIX}/{REDSHIFT_CONFIG['schema']}/{table_name}/census_{timestamp}"
+    rows_per_file = max(1, -(-table.num_rows // N_SLICES))
+    # Recomputed from rows_per_file so no shard is empty (e.g. 17 rows -> 9 files of <= 2 rows)
+    n_files = max(1, -(-table.num_rows // rows_per_file))
+
+    def upload_part(i: int) -> dict:
+        buf = pa.BufferOutputStream()
+        pq.write_table(table.slice(i * rows_per_file, rows_per_file), buf, compression='snappy')
+        body = buf.getvalue().to_pybytes()
+        s3_key = f"{prefix}/part_{i:03}.parquet"
+        S3.put_object(Bucket=S3_BUCKET, Key=s3_key, Body=body)
+        # content_length is required in manifests for columnar (Parquet) COPY
+        return {
+            'url': f"s3://{S3_BUCKET}/{s3_key}",
+            'mandatory': True,
+            'meta': {'content_length': len(body)}
+        }
+
+    with ThreadPoolExecutor(max_workers=n_files) as ex:
+        entries = list(ex.map(upload_part, range(n_files)))
+
+    manifest_key = f"{prefix}/manifest.json"
+    S3.put_object(
+        Bucket=S3_BUCKET,
+        Key=manifest_key,
+        Body=json.dumps({'entries': entries}).encode('utf-8')
+    )
+    logging.info(f"Uploaded {n_files} Parquet files for {table_name}")
+    return f"s3://{S3_BUCKET}/{manifest_key}"
+
+
+def copy_from_s3_to_redshift(conn, table_name: str, manifest_uri: str) -> None:
+    """
+    Loads the Parquet files listed in an S3 manifest into a Redshift table using the COPY command.
+    Assumes the table already exists and the IAM role has appropriate permissions.
+    """
+    schema = REDSHIFT_CONFIG['schema']
+    copy_sql = f"""
+    COPY "{schema}"."{table_name}" FROM '{manifest_uri}'
+    IAM_ROLE '{REDSHIFT_IAM_ROLE_ARN}'
+    FORMAT AS PARQUET
+    MANIFEST;
+    """
+    conn.execute(text(copy_sql))
+    logging.info(f"Loaded data into {schema}.{table_name}")
+
+
+def load_redshift_table(table_name: str, arrow_schema: pa.Schema, manifest_uri: str,
+                        sortkey: list) -> None:
+    """
+    Replaces the contents of a Redshift table with the Parquet files listed in manifest_uri.
+    If the existing table already has the expected columns and types it is TRUNCATEd and
+    reloaded, avoiding a catalog rewrite. Otherwise (missing table or schema drift) DROP,
+    CREATE and COPY run in a single transaction so readers see the old or new table, never
+    an empty one. Redshift commits TRUNCATE immediately, so that path cannot be atomic.
+    """
+    schema = REDSHIFT_CONFIG['schema']
+    with engine.connect() as conn:
+        conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}";'))
+        if existing_table_columns(conn, table_name) == expected_table_columns(arrow_schema):
+            conn.execute(text(f'TRUNCATE "{schema}"."{table_name}";'))
+            logging.info(f"Truncated table {schema}.{table_name} (schema unchanged)")
+            copy_from_s3_to_redshift(conn, table_name, manifest_uri)
+            return
+
+        conn.execute(text('BEGIN;'))
+        try:
+            create_redshift_table(conn, table_name, arrow_schema, sortkey)
+            copy_from_s3_to_redshift(conn, table_name, manifest_uri)
+            conn.execute(text('COMMIT;'))
+        except Exception:
+            conn.execute(text('ROLLBACK;'))
+            raise
+
+# -----------------------------------------------------------------------------
+#  8. Pipeline
+# -----------------------------------------------------------------------------
+def normalize_columns(df: pd.DataFrame, label: str) -> pd.DataFrame:
+    """
+    Standardizes column names (dashes to underscores, uppercase, stripped) and renames
+    them using the Excel mapping. Logs any columns that have no mapping.
+    """
+    column_mapping = get_column_mapping()
+    cols = df.columns.str.replace('-', '_', regex=False).str.upper().str.strip()
+    # A dict rename leaves unmapped labels unchanged, so no per-column fallback is needed
+    df.columns = cols
+    df.rename(columns=column_mapping, inplace=True)
+
+    unmapped = frozenset(cols) - get_known_columns()
+    if unmapped:
+        logging.warning(f"Unmapped cols in {label}: {unmapped}")
+    return df
+
+
+def describe_error(err: Exception) -> str:
+    """
+    Summarizes a fetch failure for logging without the request URL, which carries the API key.
+    RetryErrors are unwrapped to the last attempt's exception; HTTP errors report status and body.
+    """
+    if isinstance(err, RetryError):
+        err = err.last_attempt.exception()
+    if isinstance(err, httpx.HTTPStatusError):
+        return f"HTTP {err.response.status_code} – {err.response.text[:200]}"
+    if isinstance(err, httpx.RequestError):
+        return f"{type(err).__name__} (no response)"
+    return f"{type(err).__name__}: {err}"
+
+
+async def fetch_table(year: int, dataset: str, valid: list, state: str, expected: list,
+                      geo_level: str) -> pa.Table:
+    """
+    Fetches one state (or '*' for all states, or None for levels that do not nest in states)
+    and returns the rows as a normalized Arrow table, or None if the API returned no rows.
+    """
+    df = await get_census_data(year, dataset, valid, state, expected, geo_level)
+    if df.empty:
+        return None
+    return to_arrow_table(normalize_columns(df, f"{geo_level} state:{state}"))
+
+
+async def fetch_by_state(year: int, dataset: str, valid: list, states: list, expected: list,
+                         geo_level: str) -> list:
+    """
+    Fallback path when the nationwide request fails: fetches each state individually and
+    concurrently, returning the list of Arrow tables that succeeded.
+    Pacing is handled by the shared rate limiter in census_get.
+    """
+    results = await asyncio.gather(
+        *[fetch_table(year, dataset, valid, s, expected, geo_level) for s in states],
+        return_exceptions=True
+    )
+    tables = []
+    for s, result in zip(states, results):
+        if isinstance(result, Exception):
+            # If fetching data for a single state fails, log the error and skip that state.
+            logging.error(f"State {s} permanently skipped: {describe_error(result)}")
+        elif result is not None:
+            tables.append(result)
+            logging.info(f"Recovered state {s} after nationwide failure")
+    return tables
+
+
+async def fetch_dataset(year: int, geo_level: str, table_name: str, config: dict) -> list:
+    """
+    Fetches every geography for one dataset configuration and returns the list of Arrow tables.
+    Tries a single nationwide request first; for levels nested in states, falls back to
+    concurrent per-state requests if the API returns a server error.
+    """
+    geo = GEO_LEVELS[geo_level]
+    # All 50 states + DC
+    states = [f"{i:02}" for i in range(1,57) if i not in [3,7,14,43,52]]
+
+    expected = config['variables']
+    try:
+        valid = await filter_available_variables(year, config['dataset'], expected)
+        if not valid:
+            logging.warning(f"No available vars for {table_name}, skipping.")
+            return []
+
+        table = await fetch_table(year, config['dataset'], valid, '*' if geo['by_state'] else None,
+                                  expected, geo_level)
+        if table is None:
+            return []
+        logging.info(f"Collected all {geo_level} rows for table {table_name}")
+        return [table]
+
+    except RetryError as retry_err:
+        last_err = retry_err.last_attempt.exception()
+        logging.error(f"Nationwide request for {table_name} failed: {describe_error(retry_err)}")
+        # Very large variable lists can make the nationwide tract query fail server-side or
+        # time out/drop mid-transfer; those are retried state by state. Client errors
+        # (bad variables etc.) are not.
+        server_side = (isinstance(last_err, httpx.TransportError) or
+                       (isinstance(last_err, httpx.HTTPStatusError) and last_err.response.status_code >= 500))
+        if geo['by_state'] and server_side:
+            return await fetch_by_state(year, config['dataset'], valid, states, expected, geo_level)
+        return []
+
+    except Exception as e:
+        logging.error(f"Skipping table {table_name}: {describe_error(e)}")
+        return []
+
+
+async def run_pipeline(year: int, geo_level: str, datasets_dict: dict) -> None:
+    """
+    Fetches all datasets concurrently over one shared HTTP/2 client, then loads each
+    into Redshift via S3.
+    """
+    global _client
+    async with new_census_client() as client:
+        _client = client
+        try:
+            results = await asyncio.gather(
+                *[fetch_dataset(year, geo_level, table_name, config)
+                  for table_name, config in datasets_dict.items()],
+                return_exceptions=True
+            )
+        finally:
+            _client = None
+
+    for table_name, all_data in zip(datasets_dict, results):
+        if isinstance(all_data, Exception):
+            # One dataset failing must not discard the others that were fetched successfully
+            logging.error(f"Skipping table {table_name}: {describe_error(all_data)}")
+            continue
+        if all_data:
+            try:
+                # If any data was collected for the current table, concatenate the Arrow chunks by
+                # reference (no combined DataFrame is ever materialized).
+                table = pa.concat_tables(all_data, promote_options='permissive')
+                # Upload the combined data as Parquet files to S3 and get the manifest URI.
+                manifest_uri = upload_parquet_to_s3(table_name, table)
+                # Truncate or (re)create the Redshift table and load the Parquet data into it.
+                load_redshift_table(table_name, table.schema, manifest_uri, GEO_LEVELS[geo_level]['sortkey'])
+            except Exception as e:
+                # Log any errors that occur during the Redshift/S3 loading process.
+                logging.error(f"Failed loading table {table_name}: {e}")
+
+
+def run(year: int, geo_level: str, datasets_dict: dict) -> None:
+    """
+    Runs the ETL process for every dataset in datasets_dict at one geography level:
+      - Initializes the usage tracking database
+      - Fetches every dataset configuration ({table_name: {'variables', 'dataset'}}) concurrently,
+        one request per dataset with a per-state fallback for levels nested in states
+      - Normalizes and maps columns
+      - Loads the data into Redshift via S3
+    """
+    if geo_level not in GEO_LEVELS:
+        raise ValueError(f"Unsupported geo_level {geo_level!r}; expected one of {list(GEO_LEVELS)}")
+
+    init_db()
+    # Load the mapping up front so a missing/broken Excel file fails before any API calls
+    get_column_mapping()
+    asyncio.run(run_pipeline(year, geo_level, datasets_dict))
+    logging.info("Pipeline completed")